@@ -0,0 +1,84 @@
+# cython: language_level=3
+"""
+Compiled VelocityEstimator update step (optional).
+
+Build in place with:
+    cythonize -i _velocity_kernel.pyx
+
+estimate.py uses this module when it has been built and falls back to its
+Numba / pure-Python kernel otherwise.
+"""
+
+cimport cython
+from libc.math cimport fabs, sqrt
+
+# Quaternions whose squared norm is further than this from 1 are renormalized
+# (same threshold as estimate._UNIT_QUAT_EPS)
+cdef double UNIT_QUAT_EPS = 1e-6
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def update(const double[::1] q, const double[::1] a, float[::1] v, float[::1] b,
+           double decay_v, double alpha, double decay_b, double dt):
+    """
+    One velocity estimator step, writing velocity and bias in place.
+
+    Args:
+        q: Quaternion [qx, qy, qz, qw] (body → world), contiguous float64 array
+        a: Linear acceleration in body frame [ax, ay, az], m/s², contiguous float64 array
+        v: Velocity in world frame, float32 array of shape (3,), updated in place
+        b: Acceleration bias in world frame, float32 array of shape (3,), updated in place
+        decay_v: Velocity decay, 1 - λ (λ = leakage factor)
+        alpha: Bias adaptation rate α
+        decay_b: Bias decay, 1 - α
+        dt: Time step in seconds
+    """
+    cdef double qx, qy, qz, qw
+    cdef double ax, ay, az
+    cdef double tx, ty, tz
+    cdef double awx, awy, awz
+    cdef double bx, by, bz
+    cdef double n, inv
+
+    qx = q[0]
+    qy = q[1]
+    qz = q[2]
+    qw = q[3]
+    ax = a[0]
+    ay = a[1]
+    az = a[2]
+
+    # Guard against non-unit quaternions (e.g. driver glitches)
+    n = qx*qx + qy*qy + qz*qz + qw*qw
+    if n > 0.0 and fabs(n - 1.0) > UNIT_QUAT_EPS:
+        inv = 1.0 / sqrt(n)
+        qx *= inv
+        qy *= inv
+        qz *= inv
+        qw *= inv
+
+    # Step 1: Rotate acceleration from body to world frame
+    # a' = a + qw * t + cross(q_vec, t), t = 2 * cross(q_vec, a)
+    tx = 2.0 * (qy*az - qz*ay)
+    ty = 2.0 * (qz*ax - qx*az)
+    tz = 2.0 * (qx*ay - qy*ax)
+
+    awx = ax + qw*tx + (qy*tz - qz*ty)
+    awy = ay + qw*ty + (qz*tx - qx*tz)
+    awz = az + qw*tz + (qx*ty - qy*tx)
+
+    # Step 2: Bias EMA (kept in double until stored)
+    bx = decay_b * b[0] + alpha * awx
+    by = decay_b * b[1] + alpha * awy
+    bz = decay_b * b[2] + alpha * awz
+
+    # Step 3: Leaky velocity integration
+    v[0] = decay_v * v[0] + (awx - bx) * dt
+    v[1] = decay_v * v[1] + (awy - by) * dt
+    v[2] = decay_v * v[2] + (awz - bz) * dt
+
+    b[0] = bx
+    b[1] = by
+    b[2] = bz
@@ -12,8 +12,10 @@ Reads and displays 5 main sensor outputs:
 I2C Address: 0x4b (default)
 """
 
+import sys
 import time
 import math
+import numpy as np
 import board
 import busio
 from adafruit_bno08x.i2c import BNO08X_I2C
@@ -24,6 +26,41 @@ from adafruit_bno08x import (
     BNO_REPORT_ROTATION_VECTOR,
     BNO_REPORT_LINEAR_ACCELERATION,
 )
+from orientation import quaternion_to_euler
+
+
+def sleep_until(next_tick, period):
+    """
+    Sleep until the next_tick deadline (time.monotonic() seconds).
+
+    Returns:
+        The following deadline, next_tick + period. Deadlines are absolute, so
+        loop time doesn't add up; after an overrun (e.g. a stall) the schedule
+        restarts from now instead of bursting through the missed ticks.
+    """
+    now = time.monotonic()
+    if next_tick < now:
+        next_tick = now
+    else:
+        time.sleep(next_tick - now)
+    return next_tick + period
+
+
+class _BulkBNO08X_I2C(BNO08X_I2C):
+    """BNO08X_I2C that drains the SHTP bus once for all enabled reports."""
+
+    def read_all_available(self):
+        """
+        Process every pending SHTP packet in one pass.
+
+        Returns:
+            The driver's dict of latest readings keyed by report ID. Reports that
+            have not arrived yet are missing. The dict is live; read it right away.
+        """
+        # Each public property (acceleration, gyro, ...) runs this drain itself,
+        # so reading five properties costs five bus polls instead of one.
+        self._process_available_packets()
+        return self._readings
 
 
 class BNO080Reader:
@@ -39,10 +76,20 @@ class BNO080Reader:
         print(f"Initializing BNO080 at I2C address 0x{i2c_address:02x}...")
         print("Auto-calibration running in background")
 
+        # Preallocated sample arrays, overwritten in place by read_data()
+        self._accel = np.zeros(3)                    # [x, y, z]
+        self._gyro = np.zeros(3)                     # [x, y, z]
+        self._mag = np.zeros(3)                      # [x, y, z]
+        self._quat = np.array([0.0, 0.0, 0.0, 1.0])  # [x, y, z, w]
+        self._linear_accel = np.zeros(3)             # [x, y, z]
+
+        # Last linear acceleration report seen, to detect repeated (stale) reads
+        self._last_linear_accel = None
+
         try:
             # Initialize I2C bus
             self.i2c = busio.I2C(board.SCL, board.SDA, frequency=400000)
-            self.bno = BNO08X_I2C(self.i2c, address=i2c_address)
+            self.bno = _BulkBNO08X_I2C(self.i2c, address=i2c_address)
 
             # Enable all 5 main sensor reports (uses default report interval)
             print("Enabling sensor reports...")
@@ -73,68 +120,73 @@ class BNO080Reader:
             print(f"Failed to initialize BNO080: {e}")
             raise
 
-    @staticmethod
-    def quaternion_to_euler(qw, qx, qy, qz):
-        """Convert quaternion to Euler angles (roll, pitch, yaw) in radians."""
-        # Roll (x-axis rotation)
-        sinr_cosp = 2 * (qw * qx + qy * qz)
-        cosr_cosp = 1 - 2 * (qx * qx + qy * qy)
-        roll = math.atan2(sinr_cosp, cosr_cosp)
-
-        # Pitch (y-axis rotation)
-        sinp = 2 * (qw * qy - qz * qx)
-        if abs(sinp) >= 1:
-            pitch = math.copysign(math.pi / 2, sinp)
-        else:
-            pitch = math.asin(sinp)
-
-        # Yaw (z-axis rotation)
-        siny_cosp = 2 * (qw * qz + qx * qy)
-        cosy_cosp = 1 - 2 * (qy * qy + qz * qz)
-        yaw = math.atan2(siny_cosp, cosy_cosp)
-
-        return roll, pitch, yaw
+    # Convert quaternion to Euler angles (roll, pitch, yaw) in radians
+    quaternion_to_euler = staticmethod(quaternion_to_euler)
 
     def read_data(self):
-        """Read all sensor data from BNO080."""
+        """
+        Read all sensor data from BNO080.
+
+        Returns:
+            Dict with 'timestamp' (time.monotonic() seconds) and one NumPy array per sensor:
+                accel, gyro, mag, linear_accel: [x, y, z]
+                quaternion: [x, y, z, w] (BNO08x order)
+            and 'fresh': False when the driver returned the same linear
+            acceleration report as the previous read (no new packet).
+
+            The arrays are reused and overwritten by the next call;
+            copy them if a sample must outlive the next read.
+            Euler angles are not included; use quaternion_to_euler() if needed.
+        """
+        # Reports that are unavailable read as zero (identity orientation)
+        self._accel.fill(0.0)
+        self._gyro.fill(0.0)
+        self._mag.fill(0.0)
+        self._quat[:] = (0.0, 0.0, 0.0, 1.0)
+        self._linear_accel.fill(0.0)
+
         data = {
-            'timestamp': time.time(),
-            'accel': {'x': 0, 'y': 0, 'z': 0},
-            'gyro': {'x': 0, 'y': 0, 'z': 0},
-            'mag': {'x': 0, 'y': 0, 'z': 0},
-            'quaternion': {'w': 1, 'x': 0, 'y': 0, 'z': 0},
-            'euler': {'roll': 0, 'pitch': 0, 'yaw': 0},
-            'linear_accel': {'x': 0, 'y': 0, 'z': 0},
+            'timestamp': time.monotonic(),
+            'accel': self._accel,
+            'gyro': self._gyro,
+            'mag': self._mag,
+            'quaternion': self._quat,
+            'linear_accel': self._linear_accel,
+            'fresh': False,
         }
 
         try:
+            # Drain pending SHTP packets once, then pick each report out of the result
+            readings = self.bno.read_all_available()
+
             # Read accelerometer (m/s²)
-            if self.bno.acceleration is not None:
-                ax, ay, az = self.bno.acceleration
-                data['accel'] = {'x': ax, 'y': ay, 'z': az}
+            accel = readings.get(BNO_REPORT_ACCELEROMETER)
+            if accel is not None:
+                self._accel[:] = accel
 
             # Read gyroscope (rad/s)
-            if self.bno.gyro is not None:
-                gx, gy, gz = self.bno.gyro
-                data['gyro'] = {'x': gx, 'y': gy, 'z': gz}
+            gyro = readings.get(BNO_REPORT_GYROSCOPE)
+            if gyro is not None:
+                self._gyro[:] = gyro
 
             # Read magnetometer (µT)
-            if self.bno.magnetic is not None:
-                mx, my, mz = self.bno.magnetic
-                data['mag'] = {'x': mx, 'y': my, 'z': mz}
+            mag = readings.get(BNO_REPORT_MAGNETOMETER)
+            if mag is not None:
+                self._mag[:] = mag
 
             # Read quaternion (orientation)
             # BNO08x returns (i, j, k, real) = (x, y, z, w) format
-            if self.bno.quaternion is not None:
-                qx, qy, qz, qw = self.bno.quaternion
-                data['quaternion'] = {'w': qw, 'x': qx, 'y': qy, 'z': qz}
-                roll, pitch, yaw = self.quaternion_to_euler(qw, qx, qy, qz)
-                data['euler'] = {'roll': roll, 'pitch': pitch, 'yaw': yaw}
+            quat = readings.get(BNO_REPORT_ROTATION_VECTOR)
+            if quat is not None:
+                self._quat[:] = quat
 
             # Read linear acceleration (gravity removed)
-            if self.bno.linear_acceleration is not None:
-                lx, ly, lz = self.bno.linear_acceleration
-                data['linear_accel'] = {'x': lx, 'y': ly, 'z': lz}
+            linear_accel = readings.get(BNO_REPORT_LINEAR_ACCELERATION)
+            if linear_accel is not None:
+                self._linear_accel[:] = linear_accel
+                # The driver keeps returning the same tuple until a new report arrives
+                data['fresh'] = linear_accel is not self._last_linear_accel
+                self._last_linear_accel = linear_accel
 
         except Exception as e:
             print(f"Error reading BNO080 data: {e}")
@@ -143,28 +195,34 @@ class BNO080Reader:
 
     def print_data(self, data):
         """Print all 5 sensor outputs."""
-        print(f"\n{'='*80}")
-        print(f"BNO080 Sensor Data (t={data['timestamp']:.3f}s)")
-        print(f"{'='*80}")
-
-        print(f"\n1. Accelerometer (m/s²):")
-        print(f"   X: {data['accel']['x']:8.4f}  Y: {data['accel']['y']:8.4f}  Z: {data['accel']['z']:8.4f}")
-
-        print(f"\n2. Gyroscope (rad/s):")
-        print(f"   X: {data['gyro']['x']:8.4f}  Y: {data['gyro']['y']:8.4f}  Z: {data['gyro']['z']:8.4f}")
-
-        print(f"\n3. Magnetometer (µT):")
-        print(f"   X: {data['mag']['x']:8.4f}  Y: {data['mag']['y']:8.4f}  Z: {data['mag']['z']:8.4f}")
-
-        print(f"\n4. Orientation:")
-        print(f"   Quaternion - W: {data['quaternion']['w']:8.4f}  X: {data['quaternion']['x']:8.4f}")
-        print(f"                Y: {data['quaternion']['y']:8.4f}  Z: {data['quaternion']['z']:8.4f}")
-        print(f"   Euler      - Roll:  {math.degrees(data['euler']['roll']):7.2f}°  "
-              f"Pitch: {math.degrees(data['euler']['pitch']):7.2f}°  "
-              f"Yaw: {math.degrees(data['euler']['yaw']):7.2f}°")
-
-        print(f"\n5. Linear Acceleration (gravity removed, m/s²):")
-        print(f"   X: {data['linear_accel']['x']:8.4f}  Y: {data['linear_accel']['y']:8.4f}  Z: {data['linear_accel']['z']:8.4f}")
+        accel = data['accel']
+        gyro = data['gyro']
+        mag = data['mag']
+        qx, qy, qz, qw = data['quaternion']
+        roll, pitch, yaw = self.quaternion_to_euler(qw, qx, qy, qz)
+        lin = data['linear_accel']
+
+        # Build the whole block first and write it once (one console write per sample)
+        out = (
+            f"\n{'='*80}\n"
+            f"BNO080 Sensor Data (t={data['timestamp']:.3f}s)\n"
+            f"{'='*80}\n"
+            f"\n1. Accelerometer (m/s²):\n"
+            f"   X: {accel[0]:8.4f}  Y: {accel[1]:8.4f}  Z: {accel[2]:8.4f}\n"
+            f"\n2. Gyroscope (rad/s):\n"
+            f"   X: {gyro[0]:8.4f}  Y: {gyro[1]:8.4f}  Z: {gyro[2]:8.4f}\n"
+            f"\n3. Magnetometer (µT):\n"
+            f"   X: {mag[0]:8.4f}  Y: {mag[1]:8.4f}  Z: {mag[2]:8.4f}\n"
+            f"\n4. Orientation:\n"
+            f"   Quaternion - W: {qw:8.4f}  X: {qx:8.4f}\n"
+            f"                Y: {qy:8.4f}  Z: {qz:8.4f}\n"
+            f"   Euler      - Roll:  {math.degrees(roll):7.2f}°  "
+            f"Pitch: {math.degrees(pitch):7.2f}°  "
+            f"Yaw: {math.degrees(yaw):7.2f}°\n"
+            f"\n5. Linear Acceleration (gravity removed, m/s²):\n"
+            f"   X: {lin[0]:8.4f}  Y: {lin[1]:8.4f}  Z: {lin[2]:8.4f}\n"
+        )
+        sys.stdout.write(out)
 
 
 def main():
@@ -180,14 +238,24 @@ def main():
         print("Starting data acquisition...")
         print("Press Ctrl+C to stop\n")
 
+        # Drift-free 40Hz pacing against a monotonic deadline
+        period = 1/40
+        next_tick = time.monotonic() + period
+
+        # Console output costs more than the read itself; print at 10Hz
+        print_every = 4
+        iteration = 0
+
         # Read loop
         while True:
             # Read and print data
             data = imu.read_data()
-            imu.print_data(data)
+            if iteration % print_every == 0:
+                imu.print_data(data)
+            iteration += 1
 
-            # Sleep between reads
-            time.sleep(float(1/40))  # 40Hz
+            # Sleep until the next deadline (absolute, so read time doesn't add up)
+            next_tick = sleep_until(next_tick, period)
 
     except KeyboardInterrupt:
         print("\n\nStopped by user")
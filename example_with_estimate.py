@@ -8,7 +8,7 @@ Reads linear acceleration and orientation, then estimates velocity in world fram
 
 import time
 import numpy as np
-from bare import BNO080Reader
+from bare import BNO080Reader, sleep_until
 from estimate import VelocityEstimator
 
 
@@ -26,7 +26,9 @@ def calibrate_drift(imu, estimator, duration=5.0):
         duration: Calibration duration in seconds (default: 5.0)
 
     Returns:
-        drift_rate: Drift rate in m/s per second (3D vector)
+        drift_rate: Drift rate in m/s per second (3D vector), i.e. the constant
+                    world-frame acceleration offset that, with the estimator's
+                    leakage, accumulates the measured drift
     """
     print("\n" + "="*80)
     print("DRIFT CALIBRATION")
@@ -41,46 +43,54 @@ def calibrate_drift(imu, estimator, duration=5.0):
     # Reset estimator before calibration
     estimator.reset()
 
-    start_time = time.time()
+    start_time = time.monotonic()
     prev_time = None
     sample_count = 0
+    integrated_time = 0.0
 
-    while time.time() - start_time < duration:
+    # Drift-free 40Hz pacing against a monotonic deadline (keeps dt uniform)
+    period = 0.025
+    next_tick = start_time + period
+
+    while time.monotonic() - start_time < duration:
         # Read IMU data
         data = imu.read_data()
         current_time = data['timestamp']
 
-        # Calculate time step
-        if prev_time is None:
-            prev_time = current_time
-            time.sleep(0.025)
-            continue
+        # Calculate time step (the first sample only sets the reference time)
+        if prev_time is not None:
+            dt = current_time - prev_time
 
-        dt = current_time - prev_time
-        prev_time = current_time
+            # Extract linear acceleration and quaternion
+            accel_body = data['linear_accel']
+            quat = data['quaternion']
 
-        # Extract linear acceleration and quaternion
-        accel_body = np.array([
-            data['linear_accel']['x'],
-            data['linear_accel']['y'],
-            data['linear_accel']['z']
-        ])
-        quat = data['quaternion']
+            # Update estimator during calibration
+            estimator.update(accel_body, quat, dt, fresh=data['fresh'])
+            sample_count += 1
+            integrated_time += dt
 
-        # Update estimator during calibration
-        estimator.update(accel_body, quat, dt)
-        sample_count += 1
+            # Print progress indicator
+            if sample_count % 20 == 0:  # Print dot every ~0.5s
+                print(".", end="", flush=True)
 
-        # Print progress indicator
-        elapsed = time.time() - start_time
-        if sample_count % 20 == 0:  # Print dot every ~0.5s
-            print(".", end="", flush=True)
+        prev_time = current_time
 
-        time.sleep(0.025)
+        # Sleep until the next deadline (absolute, so loop time doesn't add up)
+        next_tick = sleep_until(next_tick, period)
 
     # Measure drift: velocity accumulated while stationary
     drift_velocity = estimator.get_velocity()
-    drift_rate = drift_velocity / duration
+
+    # With leakage a constant offset c saturates instead of growing linearly:
+    # after n steps of dt, v = c * dt * (1 - (1 - λ)^n) / λ, so invert that
+    # (the λ = 0 limit is v / (n * dt)).
+    lam = estimator.lambda_
+    if lam > 0 and sample_count > 0:
+        dt_mean = integrated_time / sample_count
+        drift_rate = drift_velocity * lam / (dt_mean * (1 - (1 - lam) ** sample_count))
+    else:
+        drift_rate = drift_velocity / max(integrated_time, 1e-9)
 
     # Save the bias learned during calibration
     calibrated_bias = estimator.get_bias()
@@ -94,7 +104,7 @@ def calibrate_drift(imu, estimator, duration=5.0):
     print("="*80)
 
     # Reset velocity but preserve the bias learned during calibration
-    estimator.velocity = np.zeros(3)
+    estimator.velocity.fill(0.0)
     # Note: We keep estimator.bias as-is (don't reset it)
 
     return drift_rate
@@ -130,22 +140,28 @@ def main():
         # Run drift calibration
         drift_rate = calibrate_drift(imu, estimator, duration=5.0)
 
+        # Fold the measured drift into the bias estimate: calibrate_drift() converts
+        # the drift (accounting for leakage) into a world-frame acceleration offset,
+        # the same units as estimator.bias, so update() removes it directly and no
+        # per-sample correction is needed. It is approximate (the bias also adapts
+        # during calibration) and, like the rest of the bias, refined by α.
+        estimator.bias += drift_rate
+
         print("\nStarting drift-corrected velocity estimation...")
         print("Press Ctrl+C to stop\n")
 
         prev_time = None
         iteration = 0
-        calibration_start_time = None
+
+        # Drift-free 40Hz pacing against a monotonic deadline (keeps dt uniform)
+        period = 0.025
+        next_tick = time.monotonic() + period
 
         while True:
             # Read IMU data
             data = imu.read_data()
             current_time = data['timestamp']
 
-            # Set calibration reference time on first iteration
-            if calibration_start_time is None:
-                calibration_start_time = current_time
-
             # Calculate time step
             if prev_time is None:
                 prev_time = current_time
@@ -156,23 +172,14 @@ def main():
             iteration += 1
 
             # Extract linear acceleration (body frame, gravity removed)
-            accel_body = np.array([
-                data['linear_accel']['x'],
-                data['linear_accel']['y'],
-                data['linear_accel']['z']
-            ])
+            accel_body = data['linear_accel']
 
-            # Extract orientation quaternion
+            # Extract orientation quaternion [qx, qy, qz, qw]
             quat = data['quaternion']
 
             # Update velocity estimate
-            velocity_raw = estimator.update(accel_body, quat, dt)
-
-            # Apply drift correction
-            # Subtract accumulated drift since calibration
-            elapsed_since_calibration = current_time - calibration_start_time
-            drift_correction = drift_rate * elapsed_since_calibration
-            velocity = velocity_raw - drift_correction
+            # (already drift-corrected through the calibrated bias)
+            velocity = estimator.update(accel_body, quat, dt, fresh=data['fresh'])
 
             # Get bias estimate
             bias = estimator.get_bias()
@@ -188,13 +195,7 @@ def main():
             print(f"\n  Linear Accel (body frame):  "
                   f"X:{accel_body[0]:7.3f}  Y:{accel_body[1]:7.3f}  Z:{accel_body[2]:7.3f} m/s²")
 
-            print(f"\n  Velocity Raw (world):       "
-                  f"X:{velocity_raw[0]:7.3f}  Y:{velocity_raw[1]:7.3f}  Z:{velocity_raw[2]:7.3f} m/s")
-
-            print(f"  Drift Correction:           "
-                  f"X:{drift_correction[0]:7.3f}  Y:{drift_correction[1]:7.3f}  Z:{drift_correction[2]:7.3f} m/s")
-
-            print(f"  Velocity Corrected:         "
+            print(f"\n  Velocity (world):           "
                   f"X:{velocity[0]:7.3f}  Y:{velocity[1]:7.3f}  Z:{velocity[2]:7.3f} m/s")
 
             print(f"  Speed (magnitude):          {speed:7.3f} m/s")
@@ -202,8 +203,8 @@ def main():
             print(f"\n  Accel Bias (world frame):   "
                   f"X:{bias[0]:7.3f}  Y:{bias[1]:7.3f}  Z:{bias[2]:7.3f} m/s²")
 
-            # Sleep to maintain approximate sample rate
-            time.sleep(0.025)  # Target ~40Hz
+            # Sleep until the next deadline (absolute, so loop time doesn't add up)
+            next_tick = sleep_until(next_tick, period)
 
     except KeyboardInterrupt:
         print("\n\n" + "="*80)
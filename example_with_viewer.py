@@ -3,18 +3,52 @@
 Example: BNO080 IMU with Viser Visualization
 
 This shows how to integrate the viewer with IMU data collection.
-The visualization runs in parallel without blocking data collection.
+The visualization runs in parallel without blocking data collection:
+samples are handed to a worker thread through a small bounded queue.
 """
 
 import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from bare import BNO080Reader
+from bare import BNO080Reader, sleep_until
 from viewer import IMUViewer
+import numpy as np
+import queue
+import threading
 import time
 
 
+def viz_worker(viz, samples):
+    """Drain queued (data, position) samples into the viewer (runs in a daemon thread)."""
+    while True:
+        data, position = samples.get()
+        try:
+            viz.update(data, position=position)
+        except Exception as e:
+            # Keep draining: a dead worker would silently freeze the viewer
+            print(f"Viewer update failed: {e}")
+
+
+def submit_sample(samples, data, position=None):
+    """
+    Queue a sample for the viewer without blocking the sensor loop.
+
+    read_data() reuses its arrays, so a copy is queued. When the queue is full
+    the oldest sample is dropped, so a slow viewer never backpressures the loop.
+    """
+    snapshot = {key: value.copy() if isinstance(value, np.ndarray) else value
+                for key, value in data.items()}
+    try:
+        samples.put_nowait((snapshot, position))
+    except queue.Full:
+        try:
+            samples.get_nowait()
+        except queue.Empty:
+            pass
+        samples.put_nowait((snapshot, position))
+
+
 def main():
     """Main loop with IMU data collection and visualization."""
     print("="*80)
@@ -28,39 +62,51 @@ def main():
         # Initialize visualization (starts web server at http://localhost:8080)
         viz = IMUViewer(port=8080, buffer_size=200)  # 5 seconds at 40Hz
 
+        # Viewer updates run off the 40Hz loop, fed through a bounded queue
+        viz_samples = queue.Queue(maxsize=4)
+        threading.Thread(target=viz_worker, args=(viz, viz_samples), daemon=True).start()
+
         print("\n" + "="*80)
         print("📊 Visualization running at: http://localhost:8080")
         print("="*80)
         print("\nStarting data acquisition at 40Hz...")
         print("Press Ctrl+C to stop\n")
 
+        # Drift-free 40Hz pacing against a monotonic deadline
+        period = 1/40
+        next_tick = time.monotonic() + period
+
         # Data collection loop (40Hz)
         while True:
             # Read IMU data
             data = imu.read_data()
 
-            # Update visualization (non-blocking, async)
+            # Euler angles for the orientation plot (read_data only provides the quaternion)
+            qx, qy, qz, qw = data['quaternion']
+            data['euler'] = BNO080Reader.quaternion_to_euler(qw, qx, qy, qz)
+
+            # Update visualization (non-blocking, handled by the worker thread)
             # Option 1: Update orientation only
-            viz.update(data)
+            submit_sample(viz_samples, data)
 
             # Option 2: Update both orientation and position
             # If you have position estimation (e.g., from sensor fusion):
             # position = (x, y, z)  # Position in world frame
-            # viz.update(data, position=position)
+            # submit_sample(viz_samples, data, position=position)
 
             # Optional: Print to console every second
             if int(data['timestamp']) % 1 == 0:
                 print(f"[{data['timestamp']:.1f}s] "
-                      f"Orientation: Roll={data['euler']['roll']*57.3:.1f}° "
-                      f"Pitch={data['euler']['pitch']*57.3:.1f}° "
-                      f"Yaw={data['euler']['yaw']*57.3:.1f}°")
+                      f"Orientation: Roll={data['euler'][0]*57.3:.1f}° "
+                      f"Pitch={data['euler'][1]*57.3:.1f}° "
+                      f"Yaw={data['euler'][2]*57.3:.1f}°")
                 # print(f"[{data['timestamp']:.1f}s] "
-                #       f"Acceleration: X={data['accel']['x']:.2f} "
-                #       f"Y={data['accel']['y']:.2f} "
-                #       f"Z={data['accel']['z']:.2f} m/s²")
+                #       f"Acceleration: X={data['accel'][0]:.2f} "
+                #       f"Y={data['accel'][1]:.2f} "
+                #       f"Z={data['accel'][2]:.2f} m/s²")
 
-            # Sleep to maintain 40Hz rate
-            time.sleep(1/40)
+            # Sleep until the next deadline (absolute, so loop time doesn't add up)
+            next_tick = sleep_until(next_tick, period)
 
     except KeyboardInterrupt:
         print("\n\n✓ Stopped by user")
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Orientation helpers shared by the sensor reader and the viewer.
+
+Pure math with no sensor driver imports, so the viewer can use it on machines
+without the BNO080 hardware stack.
+"""
+
+import math
+
+
+def quaternion_to_euler(qw, qx, qy, qz):
+    """Convert quaternion to Euler angles (roll, pitch, yaw) in radians."""
+    # Products shared by the three angles
+    xx = qx * qx
+    yy = qy * qy
+    zz = qz * qz
+    xy = qx * qy
+    xz = qx * qz
+    yz = qy * qz
+    wx = qw * qx
+    wy = qw * qy
+    wz = qw * qz
+
+    # Roll (x-axis rotation)
+    roll = math.atan2(2 * (wx + yz), 1 - 2 * (xx + yy))
+
+    # Pitch (y-axis rotation)
+    # Clamp instead of branching: asin(±1) = ±pi/2 at gimbal lock
+    pitch = math.asin(max(-1.0, min(1.0, 2 * (wy - xz))))
+
+    # Yaw (z-axis rotation)
+    yaw = math.atan2(2 * (wz + xy), 1 - 2 * (yy + zz))
+
+    return roll, pitch, yaw
@@ -10,21 +10,22 @@ import viser
 import numpy as np
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-from collections import deque
 import math
 import time
+from orientation import quaternion_to_euler
 
 
 class IMUViewer:
     """Real-time IMU visualization using Viser."""
 
-    def __init__(self, port=8080, buffer_size=200):
+    def __init__(self, port=8080, buffer_size=200, plot_period=0.1):
         """
         Initialize Viser-based IMU visualizer.
 
         Args:
             port: Web server port (default 8080)
             buffer_size: Number of data points to display (default 200 = 5s at 40Hz)
+            plot_period: Minimum time between plot refreshes in seconds (default 0.1 = 10Hz)
         """
         print(f"Starting Viser server on port {port}...")
         self.server = viser.ViserServer(port=port)
@@ -33,33 +34,34 @@ class IMUViewer:
         # Time tracking
         self.start_time = None
 
-        # Data buffers for time series
-        self.time_buffer = deque(maxlen=buffer_size)
-        self.gyro_buffer = {
-            'x': deque(maxlen=buffer_size),
-            'y': deque(maxlen=buffer_size),
-            'z': deque(maxlen=buffer_size)
-        }
-        self.accel_buffer = {
-            'x': deque(maxlen=buffer_size),
-            'y': deque(maxlen=buffer_size),
-            'z': deque(maxlen=buffer_size)
-        }
-        self.mag_buffer = {
-            'x': deque(maxlen=buffer_size),
-            'y': deque(maxlen=buffer_size),
-            'z': deque(maxlen=buffer_size)
-        }
-        self.linear_accel_buffer = {
-            'x': deque(maxlen=buffer_size),
-            'y': deque(maxlen=buffer_size),
-            'z': deque(maxlen=buffer_size)
-        }
-        self.euler_buffer = {
-            'roll': deque(maxlen=buffer_size),
-            'pitch': deque(maxlen=buffer_size),
-            'yaw': deque(maxlen=buffer_size)
-        }
+        # Ring buffers for time series: one row per axis, column = sample slot.
+        # float32 throughout: it is what the plots need, and plotly >= 6 sends
+        # NumPy arrays to the client as packed binary of the same dtype.
+        # _write_idx is the next slot to overwrite; _num_samples counts all samples.
+        self._write_idx = 0
+        self._num_samples = 0
+        self.time_buffer = np.zeros(buffer_size, dtype=np.float32)  # relative time (s)
+        self.gyro_buffer = np.zeros((3, buffer_size), dtype=np.float32)
+        self.accel_buffer = np.zeros((3, buffer_size), dtype=np.float32)
+        self.mag_buffer = np.zeros((3, buffer_size), dtype=np.float32)
+        self.linear_accel_buffer = np.zeros((3, buffer_size), dtype=np.float32)
+        self.euler_buffer = np.zeros((3, buffer_size), dtype=np.float32)  # roll, pitch, yaw (rad)
+
+        # Slot indices 0..N-1 twice over: any N-long slice is one unrolled ring order
+        self._ring_index = np.tile(np.arange(buffer_size), 2)
+
+        # Plot refresh throttle (wall clock, independent of the sample rate)
+        self._plot_period = plot_period
+        self._last_plot_t = -math.inf
+
+        # Scratch rows for 3D pose updates. Each update hands viser a different row
+        # (a new array object) without allocating; rows are reused after 8 updates.
+        self._wxyz_pool = np.empty((8, 4))
+        self._pos_pool = np.empty((8, 3))
+        self._pool_idx = 0
+
+        # Number of orientation updates echoed to the console (first 5 only)
+        self._debug_count = 0
 
         # Setup 3D visualization
         self._setup_3d_scene()
@@ -141,69 +143,59 @@ class IMUViewer:
         )
 
     def _setup_plots(self):
-        """Setup Plotly charts for time series visualization."""
-        # Create empty figures for each sensor type
-        self.gyro_plot = self._create_3axis_plot(
+        """Setup one Plotly figure (a subplot per sensor) for time series visualization."""
+        titles = [
             "Gyroscope (rad/s)",
-            ["Gyro X", "Gyro Y", "Gyro Z"],
-            ["red", "green", "blue"]
-        )
-
-        self.accel_plot = self._create_3axis_plot(
             "Accelerometer (m/s²)",
-            ["Accel X", "Accel Y", "Accel Z"],
-            ["red", "green", "blue"]
-        )
-
-        self.mag_plot = self._create_3axis_plot(
             "Magnetometer (µT)",
-            ["Mag X", "Mag Y", "Mag Z"],
-            ["red", "green", "blue"]
-        )
-
-        self.linear_accel_plot = self._create_3axis_plot(
             "Linear Acceleration (m/s²)",
-            ["Lin Accel X", "Lin Accel Y", "Lin Accel Z"],
-            ["red", "green", "blue"]
-        )
-
-        self.euler_plot = self._create_3axis_plot(
             "Orientation (degrees)",
+        ]
+        labels = [
+            ["Gyro X", "Gyro Y", "Gyro Z"],
+            ["Accel X", "Accel Y", "Accel Z"],
+            ["Mag X", "Mag Y", "Mag Z"],
+            ["Lin Accel X", "Lin Accel Y", "Lin Accel Z"],
             ["Roll", "Pitch", "Yaw"],
-            ["orange", "purple", "cyan"]
+        ]
+        xyz_colors = ["red", "green", "blue"]
+        euler_colors = ["orange", "purple", "cyan"]
+
+        # All sensors share one figure and time axis, so a refresh is a single
+        # push to the client (and panning/zooming stays in sync across sensors)
+        self.plot = make_subplots(
+            rows=len(titles),
+            cols=1,
+            shared_xaxes=True,
+            vertical_spacing=0.04,
+            subplot_titles=titles
         )
 
-        # Add plots to Viser GUI
-        self.gyro_plotly = self.server.gui.add_plotly(figure=self.gyro_plot)
-        self.accel_plotly = self.server.gui.add_plotly(figure=self.accel_plot)
-        self.mag_plotly = self.server.gui.add_plotly(figure=self.mag_plot)
-        self.linear_accel_plotly = self.server.gui.add_plotly(figure=self.linear_accel_plot)
-        self.euler_plotly = self.server.gui.add_plotly(figure=self.euler_plot)
+        for row, row_labels in enumerate(labels, start=1):
+            colors = euler_colors if row == len(titles) else xyz_colors
+            self._add_3axis_traces(self.plot, row, row_labels, colors)
 
-    def _create_3axis_plot(self, title, labels, colors):
-        """Create a Plotly figure with 3 traces (X, Y, Z axes)."""
-        fig = go.Figure()
+        self.plot.update_layout(
+            height=300 * len(titles),
+            margin=dict(l=40, r=40, t=40, b=40),
+            hovermode='x unified',
+            showlegend=True
+        )
+        self.plot.update_xaxes(title_text="Time (s)", row=len(titles), col=1)
+
+        # Add plot to Viser GUI (tall aspect: one 300px-high panel per sensor)
+        self.plotly = self.server.gui.add_plotly(figure=self.plot, aspect=1.0 / len(titles))
 
-        for i, (label, color) in enumerate(zip(labels, colors)):
-            fig.add_trace(go.Scatter(
+    def _add_3axis_traces(self, fig, row, labels, colors):
+        """Add 3 traces (X, Y, Z axes) to one subplot row of a Plotly figure."""
+        for label, color in zip(labels, colors):
+            fig.add_trace(go.Scattergl(  # WebGL: cheaper client redraws for streaming data
                 x=[],
                 y=[],
                 mode='lines',
                 name=label,
                 line=dict(color=color, width=2)
-            ))
-
-        fig.update_layout(
-            title=title,
-            xaxis_title="Time (s)",
-            yaxis_title="Value",
-            height=300,
-            margin=dict(l=40, r=40, t=40, b=40),
-            hovermode='x unified',
-            showlegend=True
-        )
-
-        return fig
+            ), row=row, col=1)
 
     def update(self, data, position=None):
         """
@@ -211,7 +203,11 @@ class IMUViewer:
 
         Args:
             data: Dictionary from BNO080Reader.read_data() containing:
-                  - timestamp, accel, gyro, mag, quaternion, euler, linear_accel
+                  - timestamp (seconds)
+                  - accel, gyro, mag, linear_accel: arrays [x, y, z]
+                  - quaternion: array [x, y, z, w]
+                  - euler (optional): [roll, pitch, yaw] in radians; derived
+                    from the quaternion when not provided
             position: Optional tuple (x, y, z) for IMU position in world frame
         """
         # Initialize start time on first update
@@ -221,133 +217,96 @@ class IMUViewer:
         # Calculate relative time
         relative_time = data['timestamp'] - self.start_time
 
-        # Update data buffers
-        self.time_buffer.append(relative_time)
-
-        # Gyroscope
-        self.gyro_buffer['x'].append(data['gyro']['x'])
-        self.gyro_buffer['y'].append(data['gyro']['y'])
-        self.gyro_buffer['z'].append(data['gyro']['z'])
-
-        # Accelerometer
-        self.accel_buffer['x'].append(data['accel']['x'])
-        self.accel_buffer['y'].append(data['accel']['y'])
-        self.accel_buffer['z'].append(data['accel']['z'])
-
-        # Magnetometer
-        self.mag_buffer['x'].append(data['mag']['x'])
-        self.mag_buffer['y'].append(data['mag']['y'])
-        self.mag_buffer['z'].append(data['mag']['z'])
-
-        # Linear Acceleration
-        self.linear_accel_buffer['x'].append(data['linear_accel']['x'])
-        self.linear_accel_buffer['y'].append(data['linear_accel']['y'])
-        self.linear_accel_buffer['z'].append(data['linear_accel']['z'])
-
-        # Euler angles (convert to degrees)
-        self.euler_buffer['roll'].append(math.degrees(data['euler']['roll']))
-        self.euler_buffer['pitch'].append(math.degrees(data['euler']['pitch']))
-        self.euler_buffer['yaw'].append(math.degrees(data['euler']['yaw']))
+        # Update data buffers (one column per sample)
+        idx = self._write_idx
+        self.time_buffer[idx] = relative_time
+        self.gyro_buffer[:, idx] = data['gyro']
+        self.accel_buffer[:, idx] = data['accel']
+        self.mag_buffer[:, idx] = data['mag']
+        self.linear_accel_buffer[:, idx] = data['linear_accel']
+        # Euler angles in radians (converted at plot time); read_data() has none
+        euler = data.get('euler')
+        if euler is None:
+            qx, qy, qz, qw = data['quaternion']
+            euler = quaternion_to_euler(qw, qx, qy, qz)
+        self.euler_buffer[:, idx] = euler
+
+        self._write_idx = (idx + 1) % self.buffer_size
+        self._num_samples += 1
 
         # Update 3D orientation and position
         self._update_3d_pose(data['quaternion'], position)
 
-        # Update plots (only every N samples to reduce overhead)
-        # At 40Hz, update plots every 4 samples = 10Hz
-        if len(self.time_buffer) % 4 == 0:
+        # Update plots at most once per plot period to reduce overhead
+        now = time.perf_counter()
+        if now - self._last_plot_t >= self._plot_period:
             self._update_plots()
+            done = time.perf_counter()
+            # Backpressure: if the refresh overran the period, wait a full period
+            # after it finished so updates don't pile up for a slow client
+            self._last_plot_t = done if done - now > self._plot_period else now
 
     def _update_3d_pose(self, quaternion, position=None):
         """
         Update the 3D coordinate frame orientation and position.
 
         Args:
-            quaternion: Dict with 'w', 'x', 'y', 'z' keys
+            quaternion: Array [x, y, z, w]
             position: Optional tuple (x, y, z) for position in world frame
         """
         # IMPORTANT: Viser requires explicit re-assignment to trigger client updates
-        # Create a NEW numpy array each time (don't reuse the same object)
-        new_wxyz = np.array([
-            quaternion['w'],
-            quaternion['x'],
-            quaternion['y'],
-            quaternion['z']
-        ], dtype=np.float64)
+        # Pass a NEW numpy array object each time (don't reuse the same object);
+        # a fresh row of the scratch pool is a new object without a new allocation
+        idx = self._pool_idx
+        self._pool_idx = (idx + 1) % len(self._wxyz_pool)
+
+        new_wxyz = self._wxyz_pool[idx]
+        new_wxyz[0] = quaternion[3]
+        new_wxyz[1:] = quaternion[:3]
 
         self.imu_frame.wxyz = new_wxyz
 
         # Update position if provided
         if position is not None:
-            # Also create new array for position to ensure sync
-            new_position = np.array(position, dtype=np.float64)
+            # Also use a new array object for position to ensure sync
+            new_position = self._pos_pool[idx]
+            new_position[:] = position
             self.imu_frame.position = new_position
 
         # Debug: Print quaternion changes (first 5 updates only)
-        if not hasattr(self, '_debug_count'):
-            self._debug_count = 0
         if self._debug_count < 5:
             print(f"[DEBUG] Updated IMU orientation: w={new_wxyz[0]:.3f}, x={new_wxyz[1]:.3f}, y={new_wxyz[2]:.3f}, z={new_wxyz[3]:.3f}")
             self._debug_count += 1
 
+    def _unroll_order(self):
+        """Return the oldest-to-newest slot order of the ring buffers."""
+        if self._num_samples < self.buffer_size:
+            return slice(0, self._num_samples)
+        # Full buffer: oldest sample is at the write index (a view, no allocation)
+        return self._ring_index[self._write_idx:self._write_idx + self.buffer_size]
+
     def _update_plots(self):
         """Update all time series plots with buffered data."""
-        time_array = list(self.time_buffer)
-
-        # Update Gyroscope plot
-        self._update_3axis_figure(
-            self.gyro_plot,
-            time_array,
-            [list(self.gyro_buffer['x']),
-             list(self.gyro_buffer['y']),
-             list(self.gyro_buffer['z'])]
-        )
-        self.gyro_plotly.figure = self.gyro_plot
-
-        # Update Accelerometer plot
-        self._update_3axis_figure(
-            self.accel_plot,
-            time_array,
-            [list(self.accel_buffer['x']),
-             list(self.accel_buffer['y']),
-             list(self.accel_buffer['z'])]
-        )
-        self.accel_plotly.figure = self.accel_plot
-
-        # Update Magnetometer plot
-        self._update_3axis_figure(
-            self.mag_plot,
-            time_array,
-            [list(self.mag_buffer['x']),
-             list(self.mag_buffer['y']),
-             list(self.mag_buffer['z'])]
-        )
-        self.mag_plotly.figure = self.mag_plot
-
-        # Update Linear Acceleration plot
-        self._update_3axis_figure(
-            self.linear_accel_plot,
-            time_array,
-            [list(self.linear_accel_buffer['x']),
-             list(self.linear_accel_buffer['y']),
-             list(self.linear_accel_buffer['z'])]
-        )
-        self.linear_accel_plotly.figure = self.linear_accel_plot
-
-        # Update Euler angles plot
-        self._update_3axis_figure(
-            self.euler_plot,
-            time_array,
-            [list(self.euler_buffer['roll']),
-             list(self.euler_buffer['pitch']),
-             list(self.euler_buffer['yaw'])]
-        )
-        self.euler_plotly.figure = self.euler_plot
+        # Computed once and shared by every buffer
+        order = self._unroll_order()
+        time_array = self.time_buffer[order]
+
+        # One row per trace, in subplot order (gyro, accel, mag, linear accel, euler)
+        y_rows = np.concatenate((
+            self.gyro_buffer[:, order],
+            self.accel_buffer[:, order],
+            self.mag_buffer[:, order],
+            self.linear_accel_buffer[:, order],
+            np.degrees(self.euler_buffer[:, order]),  # whole window in one pass
+        ))
 
-    def _update_3axis_figure(self, fig, time_data, y_data_list):
-        """Update a 3-axis Plotly figure with new data."""
-        for i, y_data in enumerate(y_data_list):
-            fig.data[i].x = time_data
-            fig.data[i].y = y_data
+        with self.plot.batch_update():
+            for trace, y_data in zip(self.plot.data, y_rows):
+                trace.x = time_array
+                trace.y = y_data
+
+        # Single push of the combined figure to the client
+        self.plotly.figure = self.plot
 
 
 if __name__ == "__main__":
@@ -363,49 +322,63 @@ if __name__ == "__main__":
     print("\nSimulating data updates...")
     print("Open http://localhost:8080 to see the visualization\n")
 
-    for i in range(400):  # Run for 10 seconds at 40Hz
-        t = i * 0.025  # 40Hz
-
-        # Simulate rotation (spinning around Z axis)
-        yaw = t * 1.0  # Moderate rotation (1 rad/s)
-        pitch = 0.3 * np.sin(t * 0.5)  # Gentle pitch oscillation
-        roll = 0.2 * np.cos(t * 0.7)   # Gentle roll oscillation
-
-        # Convert Euler angles to quaternion
-        cy = np.cos(yaw * 0.5)
-        sy = np.sin(yaw * 0.5)
-        cp = np.cos(pitch * 0.5)
-        sp = np.sin(pitch * 0.5)
-        cr = np.cos(roll * 0.5)
-        sr = np.sin(roll * 0.5)
-
-        cos_half_yaw = cy * cp * cr + sy * sp * sr
-        sin_half_x = cy * cp * sr - sy * sp * cr
-        sin_half_y = sy * cp * sr + cy * sp * cr
-        sin_half_z = sy * cp * cr - cy * sp * sr
-
-        # Simulate circular motion in XY plane (scaled to IMU size)
-        radius = 0.08  # 8cm radius - appropriate for small IMU
-        pos_x = radius * np.cos(t * 0.3)
-        pos_y = radius * np.sin(t * 0.3)
-        pos_z = 0.05 + 0.02 * np.sin(t)  # Gentle up-down motion (5cm ± 2cm)
-
+    # Precompute the whole 10 s trajectory at 40Hz with array math
+    n = 400
+    t = np.arange(n) * 0.025
+
+    # Simulate rotation (spinning around Z axis)
+    yaw = t * 1.0  # Moderate rotation (1 rad/s)
+    pitch = 0.3 * np.sin(t * 0.5)  # Gentle pitch oscillation
+    roll = 0.2 * np.cos(t * 0.7)   # Gentle roll oscillation
+
+    # Convert Euler angles to quaternion
+    cy = np.cos(yaw * 0.5)
+    sy = np.sin(yaw * 0.5)
+    cp = np.cos(pitch * 0.5)
+    sp = np.sin(pitch * 0.5)
+    cr = np.cos(roll * 0.5)
+    sr = np.sin(roll * 0.5)
+
+    quaternion = np.stack((
+        cy * cp * sr - sy * sp * cr,  # x
+        sy * cp * sr + cy * sp * cr,  # y
+        sy * cp * cr - cy * sp * sr,  # z
+        cy * cp * cr + sy * sp * sr,  # w
+    ), axis=1)
+    euler = np.stack((roll, pitch, yaw), axis=1)
+
+    # Simulate circular motion in XY plane (scaled to IMU size)
+    radius = 0.08  # 8cm radius - appropriate for small IMU
+    position = np.stack((
+        radius * np.cos(t * 0.3),
+        radius * np.sin(t * 0.3),
+        0.05 + 0.02 * np.sin(t),  # Gentle up-down motion (5cm ± 2cm)
+    ), axis=1)
+
+    noise = np.random.randn(n, 4)
+    accel = np.stack((np.sin(t), np.cos(t), 9.8 + noise[:, 0] * 0.1), axis=1)
+    gyro = np.stack((0.1 * np.sin(t), 0.2 * np.cos(t), np.full(n, 0.5)), axis=1)
+    mag = np.array([20.0, 10.0, 30.0]) + noise[:, 1:]
+    linear_accel = np.stack((-position[:, 0] * 0.1, -position[:, 1] * 0.1, np.zeros(n)), axis=1)
+
+    for i in range(n):  # Run for 10 seconds at 40Hz
         fake_data = {
-            'timestamp': time.time(),
-            'accel': {'x': np.sin(t), 'y': np.cos(t), 'z': 9.8 + np.random.randn() * 0.1},
-            'gyro': {'x': 0.1 * np.sin(t), 'y': 0.2 * np.cos(t), 'z': 0.5},
-            'mag': {'x': 20 + np.random.randn(), 'y': 10 + np.random.randn(), 'z': 30 + np.random.randn()},
-            'quaternion': {'w': cos_half_yaw, 'x': sin_half_x, 'y': sin_half_y, 'z': sin_half_z},
-            'euler': {'roll': roll, 'pitch': pitch, 'yaw': yaw},
-            'linear_accel': {'x': -pos_x * 0.1, 'y': -pos_y * 0.1, 'z': 0.0}
+            'timestamp': time.monotonic(),
+            'accel': accel[i],
+            'gyro': gyro[i],
+            'mag': mag[i],
+            'quaternion': quaternion[i],
+            'euler': euler[i],
+            'linear_accel': linear_accel[i]
         }
 
         # Update with both orientation and position
+        pos_x, pos_y, pos_z = position[i]
         viewer.update(fake_data, position=(pos_x, pos_y, pos_z))
         time.sleep(0.025)
 
         if i % 40 == 0:  # Print status every second
-            print(f"  Time: {t:.1f}s - Position: ({pos_x:.2f}, {pos_y:.2f}, {pos_z:.2f})")
+            print(f"  Time: {t[i]:.1f}s - Position: ({pos_x:.2f}, {pos_y:.2f}, {pos_z:.2f})")
 
     print("\n✓ Test complete! Visualization still running at http://localhost:8080")
     print("Press Enter to exit...")